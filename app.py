@@ -1,16 +1,26 @@
 import os
 import io
-import json
+import gzip
+import hashlib
 import uuid
 import zipfile
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import BinaryIO
 
+import orjson
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 
 import cloudinary
+import cloudinary.api
+import cloudinary.exceptions
 import cloudinary.uploader
+import cloudinary.utils
 
 
 # =========================
@@ -21,9 +31,28 @@ BASE_DIR = Path(__file__).parent
 STORAGE_DIR = BASE_DIR / "storage"          # cache local (no confiable en Streamlit Cloud)
 INDEX_PATH = STORAGE_DIR / "index.json"     # cache local del índice (la fuente real será Cloudinary)
 
-# Dónde guardamos el índice en Cloudinary (raw)
-VAULT_INDEX_PUBLIC_ID = os.environ.get("VAULT_INDEX_PUBLIC_ID", "filevault/index").strip()
-VAULT_INDEX_RESOURCE_TYPE = "raw"  # index.json como raw
+# Dónde guardamos el índice en Cloudinary (raw, JSON comprimido con gzip)
+VAULT_INDEX_PUBLIC_ID = os.environ.get("VAULT_INDEX_PUBLIC_ID", "filevault/index.json.gz").strip()
+VAULT_INDEX_LEGACY_PUBLIC_ID = VAULT_INDEX_PUBLIC_ID.removesuffix(".json.gz")  # índice antiguo sin comprimir
+VAULT_INDEX_RESOURCE_TYPE = "raw"  # index.json.gz como raw
+
+# Journal: cada cambio se sube como un delta pequeño; "Compactar" lo funde en el índice base
+VAULT_JOURNAL_PREFIX = os.environ.get("VAULT_JOURNAL_PREFIX", "filevault/journal/").strip()
+# Solo se compactan / borran deltas más antiguos que esto (subidas lentas, CDN con índice antiguo)
+VAULT_JOURNAL_GRACE = timedelta(minutes=10)
+# Tras un fallo leyendo el journal (p.ej. rate limit de la Admin API), no se reintenta durante este tiempo
+VAULT_JOURNAL_BACKOFF_SECONDS = 60
+
+# Subidas: a partir de este tamaño se sube por chunks de UPLOAD_CHUNK_SIZE
+UPLOAD_LARGE_THRESHOLD = 20 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 6_000_000
+UPLOAD_PARALLEL_CHUNKS = 4  # chunks subidos a la vez (varias conexiones TCP)
+
+# Listado: registros pintados por página
+PAGE_SIZE = 25
+
+# Extensiones de texto con preview en el listado
+PREVIEW_EXTENSIONS = (".txt", ".csv", ".log", ".md", ".json")
 
 st.set_page_config(page_title=APP_TITLE, page_icon="🗄️", layout="wide")
 
@@ -46,6 +75,18 @@ if not CLOUDINARY_URL:
 # Cloudinary toma credenciales desde CLOUDINARY_URL
 os.environ["CLOUDINARY_URL"] = CLOUDINARY_URL
 
+# La config del SDK se lee al importar: recargarla para que tome CLOUDINARY_URL
+# (incluidos secure_distribution / private_cdn / cname)
+cloudinary.reset_config()
+
+# URL pública y fija del índice, construida por el SDK (sin Admin API)
+VAULT_INDEX_URL = cloudinary.utils.cloudinary_url(
+    VAULT_INDEX_PUBLIC_ID, resource_type=VAULT_INDEX_RESOURCE_TYPE, secure=True
+)[0]
+VAULT_INDEX_LEGACY_URL = cloudinary.utils.cloudinary_url(
+    VAULT_INDEX_LEGACY_PUBLIC_ID, resource_type=VAULT_INDEX_RESOURCE_TYPE, secure=True
+)[0]
+
 # Password gate
 if VAULT_PASSWORD:
     if "auth_ok" not in st.session_state:
@@ -66,14 +107,38 @@ if VAULT_PASSWORD:
 # =========================
 # UTILS
 # =========================
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """
+    Sesión HTTP compartida entre reruns: reutiliza conexiones (keep-alive) con la CDN de Cloudinary.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+    return session
+
+
+SESSION = get_http_session()
+
+
 def ensure_dirs():
     STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 
+class _SafeFilenameTable(dict):
+    # tabla para str.translate: los caracteres permitidos se mantienen, cualquier otro -> "_"
+    def __missing__(self, codepoint: int) -> str:
+        self[codepoint] = "_"
+        return "_"
+
+
+_SAFE_FILENAME_TABLE = _SafeFilenameTable(
+    {ord(c): c for c in "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-"}
+)
+
+
 def safe_filename(name: str) -> str:
-    name = (name or "").strip().replace(" ", "_")
-    allowed = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-")
-    return "".join(ch if ch in allowed else "_" for ch in name)
+    # str.translate recorre el texto en C; los espacios también acaban como "_"
+    return (name or "").strip().translate(_SAFE_FILENAME_TABLE)
 
 
 def human_size(num_bytes: int) -> str:
@@ -87,61 +152,196 @@ def human_size(num_bytes: int) -> str:
 
 def add_file_record(index: dict, record: dict):
     index.setdefault("files", [])
-    index["files"].insert(0, record)
+    index["files"].append(record)  # O(1); el orden "más reciente primero" se aplica al cargar
 
 
 def delete_file_record(index: dict, file_id: str):
     index["files"] = [f for f in index.get("files", []) if f.get("id") != file_id]
 
 
+def find_by_sha256(index: dict, sha: str):
+    # registro ya subido con el mismo contenido (dedup), o None
+    return next((f for f in index.get("files", []) if f.get("sha256") == sha), None)
+
+
+def asset_in_use(index: dict, public_id: str, excluding_ids: set) -> bool:
+    # con dedup varios registros pueden apuntar al mismo asset: solo se borra si nadie más lo usa
+    return any(
+        f.get("cloudinary", {}).get("public_id") == public_id
+        for f in index.get("files", [])
+        if f.get("id") not in excluding_ids
+    )
+
+
+def search_key(rec: dict) -> str:
+    # nombre / tags / carpeta en minúsculas; "\n" evita coincidencias entre campos
+    name = rec.get("original_name", "")
+    tags = " ".join(rec.get("tags", []))
+    scope = rec.get("scope", "general")
+    return f"{name}\n{tags}\n{scope}".lower()
+
+
 def matches(rec: dict, query: str) -> bool:
+    # query ya normalizada (lower + strip) fuera del bucle
     if not query:
         return True
-    query = query.lower().strip()
-    name = rec.get("original_name", "").lower()
-    tags = " ".join(rec.get("tags", [])).lower()
-    scope = rec.get("scope", "general").lower()
-    return query in name or query in tags or query in scope
+    return query in (rec.get("_search") or search_key(rec))
+
+
+def public_record(rec: dict) -> dict:
+    # sin los campos precalculados ("_search", ...) que no se persisten
+    return {k: v for k, v in rec.items() if not k.startswith("_")}
 
 
 def upload_index_to_cloudinary(index_data: dict) -> None:
     """
-    Guarda index.json como asset RAW en Cloudinary, sobrescribiendo el anterior.
+    Guarda el índice como JSON compacto + gzip (asset RAW) en Cloudinary, sobrescribiendo el anterior.
     """
-    payload = json.dumps(index_data, ensure_ascii=False, indent=2).encode("utf-8")
+    index_bytes = orjson.dumps(index_data)  # UTF-8 compacto
+    payload = gzip.compress(index_bytes)
 
     cloudinary.uploader.upload(
         payload,
         public_id=VAULT_INDEX_PUBLIC_ID,   # fijo
         resource_type=VAULT_INDEX_RESOURCE_TYPE,
         overwrite=True,
+        invalidate=True,                    # la URL es fija: purgar la CDN al sobrescribir
         folder=None,                        # public_id ya incluye ruta
     )
 
     # cache local (útil para debug, pero no es la fuente de verdad en Cloud)
-    INDEX_PATH.write_text(payload.decode("utf-8"), encoding="utf-8")
+    INDEX_PATH.write_bytes(index_bytes)
 
 
-def download_index_from_cloudinary() -> dict:
+def upload_index_delta(op: str, record: dict) -> None:
     """
-    Intenta descargar el index desde Cloudinary. Si no existe todavía, crea uno vacío.
+    Guarda un cambio ("add" / "del") como asset RAW en el journal, sin reescribir el índice entero.
+    El nombre empieza por timestamp UTC para que el orden alfabético sea el de aplicación.
     """
-    try:
-        # Genera URL del raw asset y lo pide por HTTP
-        # Nota: el raw asset tiene URL pública (secure_url) una vez creado.
-        # Si aún no existe, esta llamada recognize fallback.
-        res = cloudinary.api.resource(
-            VAULT_INDEX_PUBLIC_ID,
-            resource_type=VAULT_INDEX_RESOURCE_TYPE
+    ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    delta = {"op": op, "record": record}
+
+    cloudinary.uploader.upload(
+        orjson.dumps(delta),
+        public_id=f"{VAULT_JOURNAL_PREFIX}{ts}-{uuid.uuid4().hex}.json",
+        resource_type=VAULT_INDEX_RESOURCE_TYPE,
+        folder=None,
+    )
+
+
+def list_journal_entries() -> list:
+    """
+    Lista (Admin API) los deltas del journal, ordenados por public_id.
+    """
+    entries = []
+    cursor = None
+    while True:
+        res = cloudinary.api.resources(
+            type="upload",
+            resource_type=VAULT_INDEX_RESOURCE_TYPE,
+            prefix=VAULT_JOURNAL_PREFIX,
+            max_results=500,
+            next_cursor=cursor,
         )
-        url = res.get("secure_url")
-        if not url:
-            raise RuntimeError("Index sin secure_url")
-
-        r = requests.get(url, timeout=20)
-        r.raise_for_status()
-        return r.json()
-    except Exception:
+        entries.extend(res.get("resources", []))
+        cursor = res.get("next_cursor")
+        if not cursor:
+            break
+    return sorted(entries, key=lambda e: e["public_id"])
+
+
+def apply_journal(index: dict, entries: list | None = None) -> dict:
+    """
+    Aplica sobre el índice base, en orden, los deltas que aún no están fundidos en él
+    (index["journal_merged"]). Reaplicar un delta ya aplicado no cambia nada.
+    """
+    if entries is None:
+        entries = list_journal_entries()
+    merged = set(index.get("journal_merged", []))
+    pending = [e for e in entries if e["public_id"] not in merged]
+    if not pending:
+        return index
+
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        deltas = list(ex.map(lambda e: _fetch_delta(e["secure_url"]), pending))
+
+    # Replay sobre un dict por id (conserva el orden de inserción): O(N + K), no O(N·K)
+    by_id = {f.get("id") or f"__row{i}": f for i, f in enumerate(index.get("files", []))}
+    for delta in deltas:
+        record = delta.get("record", {})
+        if delta.get("op") == "add":
+            by_id.pop(record.get("id"), None)  # idempotente si ya estaba; pasa al final como append
+            by_id[record.get("id")] = record
+        elif delta.get("op") == "del":
+            for file_id in record.get("ids") or [record.get("id")]:
+                by_id.pop(file_id, None)
+
+    index["files"] = list(by_id.values())
+    return index
+
+
+@st.cache_data(max_entries=10_000, show_spinner=False)
+def _fetch_delta(url: str) -> dict:
+    # los deltas no cambian nunca (nombre único): se descargan una sola vez
+    r = SESSION.get(url, timeout=20)
+    r.raise_for_status()
+    return orjson.loads(r.content)
+
+
+def _journal_created_at(entry: dict) -> datetime:
+    # created_at de la Admin API ("2026-01-31T12:00:00Z"): momento en que terminó la subida
+    return datetime.fromisoformat(entry["created_at"].replace("Z", "+00:00"))
+
+
+def compact_index() -> int:
+    """
+    Funde en un nuevo índice base los deltas con más de VAULT_JOURNAL_GRACE de antigüedad.
+    Los deltas fundidos quedan en index["journal_merged"] y solo se borran en una compactación
+    posterior, cuando el índice que los incluye lleva ya VAULT_JOURNAL_GRACE publicado.
+    Devuelve cuántos deltas se han fundido.
+    """
+    entries = list_journal_entries()
+    base = _download_base_index(latest=True)
+    cutoff = datetime.now(timezone.utc) - VAULT_JOURNAL_GRACE
+
+    listed = {e["public_id"] for e in entries}
+    merged = set(base.get("journal_merged", [])) & listed
+    compacted_at = base.get("compacted_at")
+    base_settled = not compacted_at or datetime.fromisoformat(compacted_at) <= cutoff
+    to_delete = sorted(merged) if base_settled else []
+    to_merge = [e for e in entries if e["public_id"] not in merged and _journal_created_at(e) <= cutoff]
+
+    if to_merge or merged != set(base.get("journal_merged", [])):
+        index = apply_journal(base, to_merge)
+        index["journal_merged"] = sorted(merged | {e["public_id"] for e in to_merge})
+        index["compacted_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        upload_index_to_cloudinary(index)
+
+    # Nunca se borra un delta que no esté ya en un índice base publicado hace más de VAULT_JOURNAL_GRACE
+    cloudinary_delete_assets(to_delete, VAULT_INDEX_RESOURCE_TYPE)
+    return len(to_merge)
+
+
+def _download_base_index(latest: bool = False) -> dict:
+    """
+    Intenta descargar el index base desde Cloudinary. Si no existe todavía, crea uno vacío.
+    Con latest=True pide la URL versionada de la última versión (Admin API) para no leer
+    una copia antigua de la CDN; se usa al compactar.
+    """
+    # El public_id es fijo, así que la URL se conoce de antemano: un solo GET.
+    url = VAULT_INDEX_URL
+    if latest:
+        try:
+            url = cloudinary.api.resource(
+                VAULT_INDEX_PUBLIC_ID, resource_type=VAULT_INDEX_RESOURCE_TYPE
+            )["secure_url"]
+        except cloudinary.exceptions.NotFound:
+            pass
+    r = SESSION.get(url, timeout=20)
+    if r.status_code == 404 and VAULT_INDEX_LEGACY_URL != VAULT_INDEX_URL:
+        # Vaults creados antes del índice comprimido: se migra al compactar
+        r = SESSION.get(VAULT_INDEX_LEGACY_URL, timeout=20)
+    if r.status_code == 404:
         empty = {"files": []}
         try:
             upload_index_to_cloudinary(empty)
@@ -150,20 +350,151 @@ def download_index_from_cloudinary() -> dict:
             pass
         return empty
 
+    r.raise_for_status()
+    content = r.content
+    if content[:2] == b"\x1f\x8b":  # cabecera gzip (el índice antiguo es JSON plano)
+        content = gzip.decompress(content)
+    return orjson.loads(content)
+
+
+class JournalUnavailable(Exception):
+    """
+    No se pudo leer el journal; lleva el índice base ya descargado para usarlo como respaldo.
+    """
+    def __init__(self, base: dict, cause: Exception):
+        super().__init__(str(cause))
+        self.base = base
+
+
+def _prepare_index(index: dict) -> dict:
+    # más reciente primero; a igual uploaded_at (mismo segundo, p.ej. re-subidas con dedup)
+    # gana el añadido después, como hacía insert(0, ...)
+    ranked = sorted(
+        enumerate(index.setdefault("files", [])),
+        key=lambda p: (p[1].get("uploaded_at", ""), p[0]),
+        reverse=True,
+    )
+    index["files"] = [f for _, f in ranked]
+    for rec in index["files"]:
+        rec["_search"] = search_key(rec)  # una vez por carga, no por cada tecla en el buscador
+    index["_scopes"] = sorted({f.get("scope", "general") for f in index.get("files", [])})
+    return index
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_index_raw() -> dict:
+    """
+    Índice base + journal pendiente. Cacheado entre reruns; invalidar con _fetch_index_raw.clear() tras cada cambio.
+    Si falla el journal lanza JournalUnavailable: el respaldo se cachea aparte (_fetch_base_index_cached).
+    """
+    base = _download_base_index()
+    try:
+        # apply_journal descarga todo antes de tocar el índice: si falla, base queda intacto
+        index = apply_journal(base)
+    except Exception as e:  # Admin API (rate limit, 5xx) o algún delta inaccesible
+        raise JournalUnavailable(base, e) from e
+    return _prepare_index(index)
+
+
+@st.cache_resource
+def _journal_backoff() -> dict:
+    # compartido entre sesiones: hasta cuándo (time.monotonic) no se vuelve a pedir el journal
+    return {"until": 0.0, "error": ""}
+
+
+@st.cache_data(ttl=VAULT_JOURNAL_BACKOFF_SECONDS, show_spinner=False)
+def _fetch_base_index_cached() -> dict:
+    # respaldo mientras dura el backoff: solo el índice base, sin Admin API
+    return _prepare_index(_download_base_index())
+
 
-def cloudinary_upload_file(data: bytes, scope: str, original_name: str, now: datetime) -> dict:
+def download_index_from_cloudinary(force: bool = False) -> dict:
     """
-    Sube cualquier archivo a Cloudinary usando resource_type='auto'
+    Devuelve el índice (cacheado). Con force=True descarta la caché y lo vuelve a pedir.
+    Si el journal no está disponible, devuelve el índice base con un aviso y no reintenta
+    el journal hasta pasados VAULT_JOURNAL_BACKOFF_SECONDS.
+    """
+    backoff = _journal_backoff()
+    if force:
+        _fetch_index_raw.clear()
+        backoff["until"] = 0.0
+
+    if time.monotonic() >= backoff["until"]:
+        try:
+            return _fetch_index_raw()
+        except JournalUnavailable as e:
+            backoff.update(until=time.monotonic() + VAULT_JOURNAL_BACKOFF_SECONDS, error=str(e))
+            _fetch_base_index_cached.clear()
+            index = _prepare_index(e.base)
+    else:
+        index = _fetch_base_index_cached()
+
+    st.warning(
+        f"No se pudo leer el journal ({backoff['error']}); se muestra el índice base sin los últimos cambios."
+    )
+    return index
+
+
+def _upload_chunked_parallel(data: BinaryIO, size: int, options: dict) -> dict:
+    """
+    Subida por chunks (Content-Range + X-Unique-Upload-Id) con los chunks intermedios en paralelo.
+    El primero va solo (fija el public_id) y el último al final (su respuesta es el asset completo).
+    """
+    upload_id = cloudinary.utils.random_public_id()
+    file_name = options.get("filename") or "stream"
+    offsets = list(range(0, size, UPLOAD_CHUNK_SIZE))
+    read_lock = threading.Lock()
+
+    def send(offset: int, opts: dict) -> dict:
+        # Solo se lee el chunk cuando toca enviarlo: en memoria hay como mucho un chunk por hilo
+        with read_lock:
+            data.seek(offset)
+            chunk = data.read(UPLOAD_CHUNK_SIZE)
+        headers = {
+            "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}",
+            "X-Unique-Upload-Id": upload_id,
+        }
+        return cloudinary.uploader.upload_large_part((file_name, chunk), http_headers=headers, **opts)
+
+    first = send(offsets[0], dict(options))
+    if len(offsets) == 1:
+        return first
+
+    options = dict(options, public_id=first.get("public_id"))
+    with ThreadPoolExecutor(max_workers=UPLOAD_PARALLEL_CHUNKS) as ex:
+        list(ex.map(lambda offset: send(offset, dict(options)), offsets[1:-1]))
+
+    return send(offsets[-1], dict(options))
+
+
+def cloudinary_upload_file(data: BinaryIO, scope: str, original_name: str, now: datetime) -> dict:
+    """
+    Sube cualquier archivo (file-like) a Cloudinary usando resource_type='auto'.
+    Los archivos pequeños van como memoryview del buffer (el SDK haría read() de un stream, copiándolo);
+    los grandes se suben por chunks en paralelo.
     """
     folder = f"filevault/{scope}/{now.strftime('%Y-%m')}"
-    upload_res = cloudinary.uploader.upload(
-        data,
+    options = dict(
         folder=folder,
         resource_type="auto",   # permite imágenes + pdf + zip + etc  [oai_citation:1‡Cloudinary](https://cloudinary.com/documentation/upload_parameters?utm_source=chatgpt.com)
         use_filename=True,
         unique_filename=True,
+        filename=original_name,
+        # Sin eager/async a propósito: no pedimos transformaciones (eager_async no cambiaría nada)
+        # y async=True no devuelve secure_url, que el índice necesita al momento (no hay webhook).
     )
-    return upload_res
+
+    data.seek(0, io.SEEK_END)
+    size = data.tell()
+    data.seek(0)
+
+    if size > UPLOAD_LARGE_THRESHOLD:
+        return _upload_chunked_parallel(data, size, options)
+    if size and hasattr(data, "getbuffer"):
+        # memoryview: handle_file_parameter y urllib3 lo escriben tal cual, sin copiarlo a bytes
+        # (vacío es falsy para el SDK, por eso los archivos de 0 bytes van como stream)
+        return cloudinary.uploader.upload(data.getbuffer(), **options)
+    return cloudinary.uploader.upload(data, **options)
 
 
 def cloudinary_delete_asset(public_id: str, resource_type: str) -> None:
@@ -173,6 +504,41 @@ def cloudinary_delete_asset(public_id: str, resource_type: str) -> None:
     cloudinary.uploader.destroy(public_id, resource_type=resource_type, invalidate=True)  #  [oai_citation:2‡Cloudinary](https://cloudinary.com/documentation/delete_assets?utm_source=chatgpt.com)
 
 
+def cloudinary_delete_assets(public_ids: list, resource_type: str) -> None:
+    """
+    Borra varios assets del mismo resource_type con la Admin API (hasta 100 por llamada).
+    """
+    for i in range(0, len(public_ids), 100):
+        cloudinary.api.delete_resources(public_ids[i:i + 100], resource_type=resource_type, invalidate=True)
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def fetch_preview(url: str) -> str:
+    """
+    Primeros 2500 caracteres de un archivo de texto remoto (cacheado por secure_url).
+    """
+    r = SESSION.get(url, timeout=15)
+    r.raise_for_status()
+    return r.text[:2500]
+
+
+def fetch_previews(urls: list) -> dict:
+    """
+    Previews de varios archivos en paralelo (con la caché de fetch_preview). url -> texto, o None si falla.
+    """
+    def safe_fetch(url: str):
+        try:
+            return fetch_preview(url)
+        except Exception:
+            return None
+
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        return dict(zip(urls, ex.map(safe_fetch, urls)))
+
+
 # =========================
 # INIT
 # =========================
@@ -187,24 +553,30 @@ files = idx.get("files", [])
 st.sidebar.title("⚙️ Herramientas")
 
 if st.sidebar.button("🔄 Recargar índice"):
-    idx = download_index_from_cloudinary()
-    files = idx.get("files", [])
+    download_index_from_cloudinary(force=True)
     st.rerun()
 
+if st.sidebar.button("🧹 Compactar índice"):
+    try:
+        n = compact_index()
+        _fetch_index_raw.clear()
+        st.sidebar.success(f"Compactados {n} cambios del journal")
+    except Exception as e:
+        st.sidebar.error(f"No se pudo compactar: {e}")
+
 if st.sidebar.button("📦 Backup (index + manifest)"):
     mem = io.BytesIO()
-    with zipfile.ZipFile(mem, "w", zipfile.ZIP_DEFLATED) as z:
-        index_txt = json.dumps(idx, ensure_ascii=False, indent=2)
-        z.writestr("index.json", index_txt)
-
-        # manifest con URLs
-        lines = []
-        for f in idx.get("files", []):
-            ci = f.get("cloudinary", {})
-            lines.append(
-                f'{f.get("uploaded_at","")} | {f.get("scope","general")} | {f.get("original_name","")} | {ci.get("resource_type","")} | {ci.get("secure_url","")}'
-            )
-        z.writestr("manifest.txt", "\n".join(lines))
+    # compresslevel=1: mucho más rápido que el 6 por defecto con casi el mismo ratio en JSON/texto
+    with zipfile.ZipFile(mem, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+        backup = dict(public_record(idx), files=[public_record(f) for f in idx.get("files", [])])
+        z.writestr("index.json", orjson.dumps(backup, option=orjson.OPT_INDENT_2))
+
+        # manifest con URLs, escrito línea a línea directamente en el ZIP
+        with z.open("manifest.txt", "w") as manifest:
+            for i, f in enumerate(idx.get("files", [])):
+                ci = f.get("cloudinary", {})
+                line = f'{f.get("uploaded_at","")} | {f.get("scope","general")} | {f.get("original_name","")} | {ci.get("resource_type","")} | {ci.get("secure_url","")}'
+                manifest.write((("\n" if i else "") + line).encode("utf-8"))
 
     mem.seek(0)
     st.sidebar.download_button("⬇️ Descargar ZIP", mem, file_name="vault_backup.zip")
@@ -220,60 +592,103 @@ st.sidebar.caption(f"Índice Cloudinary: public_id = {VAULT_INDEX_PUBLIC_ID} (ra
 st.title("🗄️ File Vault (Cloudinary, sin BD)")
 st.caption("Los archivos se guardan en Cloudinary y el índice también (para que no se pierda al reiniciar Streamlit Cloud).")
 
-col1, col2 = st.columns([1, 1], gap="large")
 
-# ---------- SUBIR ----------
-with col1:
-    st.subheader("⬆️ Subir archivo")
+def on_save(idx: dict):
+    """
+    Callback de "Guardar en vault": el archivo solo se lee (hash + subida) al pulsar,
+    no en cada rerun provocado por los otros campos.
+    """
+    up = st.session_state.get("upload_file")
+    if up is None:
+        return
 
-    scope = st.text_input("Carpeta / Proyecto", value="general", help="Ej: cliente_a, proyecto_x").strip().lower()
-    scope = safe_filename(scope) or "general"
+    scope = safe_filename(st.session_state.get("upload_scope", "").strip().lower()) or "general"
+    tags_txt = st.session_state.get("upload_tags", "")
+    now = datetime.now()
 
-    up = st.file_uploader("Elige un archivo", type=None)
-    tags_txt = st.text_input("Tags (separados por coma)", placeholder="facturas, cliente_x, enero")
+    original_name = up.name
+    file_id = uuid.uuid4().hex
+    up.seek(0)  # cloudinary_upload_file sube desde el buffer del UploadedFile, sin tobytes()
+    sha = hashlib.sha256(up.getbuffer()).hexdigest()  # memoryview: sin copia
 
-    if up is not None and st.button("Guardar en vault", type="primary"):
-        now = datetime.now()
+    try:
+        # índice actual (cacheado, se limpia en cada cambio), no el del último run completo de la sesión:
+        # otra sesión puede haber borrado el asset con el que se enlazaría
+        existing = find_by_sha256(download_index_from_cloudinary(), sha)
+        if existing:
+            # Mismo contenido ya en Cloudinary: nuevo registro apuntando al mismo asset, sin subir nada
+            cloudinary_info = dict(existing.get("cloudinary", {}))
+        else:
+            upload_res = cloudinary_upload_file(up, scope, original_name, now)
+            cloudinary_info = {
+                "public_id": upload_res.get("public_id"),
+                "secure_url": upload_res.get("secure_url"),
+                "bytes": int(upload_res.get("bytes", up.size)),
+                "resource_type": upload_res.get("resource_type"),  # image / video / raw
+                "format": upload_res.get("format"),
+            }
 
-        original_name = up.name
-        file_id = uuid.uuid4().hex
-        data = up.getbuffer().tobytes()
+        record = {
+            "id": file_id,
+            "scope": scope,
+            "original_name": original_name,
+            "uploaded_at": now.isoformat(timespec="seconds"),
+            "tags": [t.strip() for t in tags_txt.split(",") if t.strip()],
+            "sha256": sha,
+            "cloudinary": cloudinary_info,
+        }
+
+        add_file_record(idx, record)
+        upload_index_delta("add", record)
+
+        _fetch_index_raw.clear()
+        st.session_state.upload_msg = (
+            "success",
+            f"{'Ya estaba en Cloudinary (dedup)' if existing else 'Guardado en Cloudinary'}: {original_name}",
+        )
+        st.session_state.upload_refresh = True  # st.rerun() no hace nada dentro de un callback
 
-        try:
-            upload_res = cloudinary_upload_file(data, scope, original_name, now)
-            record = {
-                "id": file_id,
-                "scope": scope,
-                "original_name": original_name,
-                "uploaded_at": now.isoformat(timespec="seconds"),
-                "tags": [t.strip() for t in tags_txt.split(",") if t.strip()],
-                "cloudinary": {
-                    "public_id": upload_res.get("public_id"),
-                    "secure_url": upload_res.get("secure_url"),
-                    "bytes": int(upload_res.get("bytes", len(data))),
-                    "resource_type": upload_res.get("resource_type"),  # image / video / raw
-                    "format": upload_res.get("format"),
-                },
-            }
+    except Exception as e:
+        st.session_state.upload_msg = ("error", f"Error subiendo a Cloudinary: {e}")
 
-            add_file_record(idx, record)
-            upload_index_to_cloudinary(idx)
 
-            st.success(f"Guardado en Cloudinary: {original_name}")
-            st.rerun()
+# Cada columna es un fragment: sus widgets solo re-ejecutan su propio bloque,
+# no el script entero (índice, filtro, previews...). st.rerun() sí recarga toda la app.
+# ---------- SUBIR ----------
+@st.fragment
+def upload_panel(idx: dict):
+    if st.session_state.pop("upload_refresh", False):
+        st.rerun()  # app entera: índice, listado y sidebar al día tras guardar
+
+    st.subheader("⬆️ Subir archivo")
+
+    st.text_input("Carpeta / Proyecto", value="general", help="Ej: cliente_a, proyecto_x", key="upload_scope")
+
+    up = st.file_uploader("Elige un archivo", type=None, key="upload_file")
+    st.text_input("Tags (separados por coma)", placeholder="facturas, cliente_x, enero", key="upload_tags")
+
+    if up is not None:
+        st.button("Guardar en vault", type="primary", on_click=on_save, args=(idx,))
+
+    msg = st.session_state.pop("upload_msg", None)
+    if msg:
+        kind, text = msg
+        (st.success if kind == "success" else st.error)(text)
 
-        except Exception as e:
-            st.error(f"Error subiendo a Cloudinary: {e}")
 
 # ---------- LISTAR ----------
-with col2:
+@st.fragment
+def files_panel(idx: dict):
+    files = idx.get("files", [])
     st.subheader("📂 Archivos")
 
-    all_scopes = sorted(list({f.get("scope", "general") for f in files})) if files else []
+    all_scopes = idx.get("_scopes", [])  # precalculado al cargar el índice
     scope_filter = st.selectbox("Ver carpeta", ["(todas)"] + all_scopes, index=0)
 
-    q = st.text_input("Buscar por nombre o tag", placeholder="factura, png, cliente_x...")
+    q = st.text_input("Buscar por nombre o tag", placeholder="factura, png, cliente_x...").lower().strip()
 
+    # El índice ya está parseado (caché + argumento del fragment): filtrar no vuelve a leer JSON,
+    # y filtered solo guarda referencias a los registros que coinciden.
     filtered = []
     for f in files:
         if scope_filter != "(todas)" and f.get("scope", "general") != scope_filter:
@@ -283,7 +698,45 @@ with col2:
 
     st.write(f"Mostrando **{len(filtered)}** de **{len(files)}**")
 
-    for rec in filtered:
+    selected = [f for f in filtered if st.session_state.get(f"sel_{f.get('id')}")]
+    if selected and st.button(f"🗑️ Borrar seleccionados ({len(selected)})"):
+        try:
+            # Una llamada delete_resources por resource_type y un único delta en el journal
+            ids = [rec.get("id") for rec in selected]
+            current = download_index_from_cloudinary()  # otras sesiones pueden compartir el asset (dedup)
+            by_type = {}
+            for rec in selected:
+                ci = rec.get("cloudinary", {})
+                public_id = ci.get("public_id")
+                if public_id and not asset_in_use(current, public_id, set(ids)):
+                    type_ids = by_type.setdefault(ci.get("resource_type", "image"), [])
+                    if public_id not in type_ids:
+                        type_ids.append(public_id)
+            for rtype, public_ids in by_type.items():
+                cloudinary_delete_assets(public_ids, rtype)
+
+            for file_id in ids:
+                delete_file_record(idx, file_id)
+            upload_index_delta("del", {"ids": ids})
+            _fetch_index_raw.clear()
+            st.rerun()
+        except Exception as e:
+            st.error(f"No se pudo borrar: {e}")
+
+    # Solo se crean widgets para una página: el coste de pintar no crece con el vault
+    n_pages = max(1, (len(filtered) + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = st.number_input("Página", min_value=1, max_value=n_pages, value=1, step=1) if n_pages > 1 else 1
+    page_recs = filtered[(page - 1) * PAGE_SIZE: page * PAGE_SIZE]
+
+    # Previews de texto pedidas todas a la vez antes de pintar (en frío: ~1 RTT en vez de N)
+    previews = fetch_previews([
+        rec.get("cloudinary", {}).get("secure_url")
+        for rec in page_recs
+        if rec.get("cloudinary", {}).get("secure_url")
+        and Path(rec.get("original_name", "")).suffix.lower() in PREVIEW_EXTENSIONS
+    ])
+
+    for rec in page_recs:
         ci = rec.get("cloudinary", {})
         url = ci.get("secure_url", "")
         public_id = ci.get("public_id", "")
@@ -308,14 +761,10 @@ with col2:
                     st.image(url)
 
                 # Para textos/JSON pequeños, intentamos mostrar (si es raw y accesible)
+                # la extensión del propio registro: con dedup, foo.bin puede compartir URL con foo.txt
                 ext = Path(rec.get("original_name", "")).suffix.lower()
-                if ext in [".txt", ".csv", ".log", ".md", ".json"] and url:
-                    try:
-                        rr = requests.get(url, timeout=15)
-                        if rr.ok:
-                            st.code(rr.text[:2500])
-                    except Exception:
-                        pass
+                if ext in PREVIEW_EXTENSIONS and previews.get(url) is not None:
+                    st.code(previews[url])
 
             with right:
                 if url:
@@ -323,12 +772,25 @@ with col2:
                 else:
                     st.warning("Sin URL")
 
+                st.checkbox("Seleccionar", key=f"sel_{rec.get('id')}")
+
                 if st.button("🗑️ Borrar", use_container_width=True, key=f"del_{rec.get('id')}"):
                     try:
-                        if public_id:
+                        current = download_index_from_cloudinary()  # otras sesiones pueden compartir el asset (dedup)
+                        if public_id and not asset_in_use(current, public_id, {rec.get("id")}):
                             cloudinary_delete_asset(public_id, rtype)
                         delete_file_record(idx, rec.get("id"))
-                        upload_index_to_cloudinary(idx)
+                        upload_index_delta("del", {"id": rec.get("id")})
+                        _fetch_index_raw.clear()
                         st.rerun()
                     except Exception as e:
-                        st.error(f"No se pudo borrar: {e}")
\ No newline at end of file
+                        st.error(f"No se pudo borrar: {e}")
+
+
+col1, col2 = st.columns([1, 1], gap="large")
+
+with col1:
+    upload_panel(idx)
+
+with col2:
+    files_panel(idx)